@@ -1,23 +1,90 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-import PyPDF2
+from quart import Quart, request, jsonify
+from quart_cors import cors
+import pypdfium2 as pdfium
 from docx import Document
 import io
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import asyncio
+import hashlib
+import pickle
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from scipy import sparse
 import numpy as np
+import orjson
 import os
 
-app = Flask(__name__)
-CORS(app)  # Permitir requisições do frontend
+app = Quart(__name__)
+app = cors(app, allow_origin="*")  # Permitir requisições do frontend
+
+# scikit-learn é importado só na primeira análise (ver load_sklearn),
+# para não atrasar o cold start do servidor nem dos processos do pool
+sklearn_lock = threading.Lock()
+hashing_vectorizer = None  # Vetorizador sem estado, compartilhado entre requisições
+idf_transformer = None
+
+# Parâmetros do HashingVectorizer; o idf.pkl (ver build_idf.py) deve ser
+# ajustado sobre contagens geradas com exatamente estes parâmetros
+HASHING_PARAMS = dict(
+    n_features=2**20,
+    stop_words=None,  # Pode adicionar stop words em português se quiser
+    ngram_range=(1, 2),  # Usar unigramas e bigramas
+    alternate_sign=False,
+    norm=None,
+    dtype=np.float32  # Precisão suficiente para o limiar de 40%, metade da memória
+)
+
+# Similaridade mínima para reportar um par e linhas processadas por bloco
+SIMILARITY_THRESHOLD = 0.40
+SIMILARITY_BLOCK_SIZE = 16
+
+# Usar a GPU para o produto esparso (requer CuPy e USE_GPU=1); o CuPy só é
+# importado quando habilitado (ver _load_cupy), sem CuPy tudo roda na CPU com SciPy
+USE_GPU = os.environ.get('USE_GPU', '').lower() in ('1', 'true')
+cupy_sparse = None
+cusparse = None
+# Abaixo deste número de entradas não nulas a transferência para a GPU não compensa
+GPU_MIN_NNZ = int(os.environ.get('GPU_MIN_NNZ', 5000))
+
+# IDF pré-calculado sobre um corpus de referência (opcional, gerado por build_idf.py)
+IDF_MODEL_PATH = os.environ.get(
+    'IDF_MODEL_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'idf.pkl')
+)
+
+# Tamanho máximo de cada arquivo enviado (em bytes) e número máximo de arquivos
+MAX_FILE_SIZE = int(os.environ.get('MAX_FILE_SIZE', 20 * 1024 * 1024))
+MAX_FILES = 100
+
+# O Quart limita o corpo a 16 MiB por padrão (o Flask não limitava); permitir
+# MAX_FILES arquivos de até MAX_FILE_SIZE, com folga para o multipart
+app.config['MAX_CONTENT_LENGTH'] = MAX_FILES * MAX_FILE_SIZE + 1024 * 1024
+# Uploads grandes podem levar mais que os 60 s padrão para chegar
+app.config['BODY_TIMEOUT'] = int(os.environ.get('BODY_TIMEOUT', 300))
+
+# Cache de textos extraídos por hash do conteúdo do arquivo, limitado pelo
+# total de caracteres guardados (acessado apenas pelo event loop)
+TEXT_CACHE_MAX_CHARS = int(os.environ.get('TEXT_CACHE_MAX_CHARS', 20_000_000))
+text_cache = OrderedDict()
+text_cache_chars = 0
+
+# Cache de linhas vetorizadas por hash do texto (evita re-tokenizar documentos repetidos),
+# limitado pelo total de entradas não nulas (~8 bytes cada: valor float32 + índice)
+VECTOR_CACHE_MAX_NNZ = int(os.environ.get('VECTOR_CACHE_MAX_NNZ', 10_000_000))
+vector_cache = OrderedDict()
+vector_cache_nnz = 0
+vector_cache_lock = threading.Lock()
 
 def extract_text_from_pdf(pdf_file):
     """Extrai texto de um arquivo PDF"""
     try:
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text()
+        pdf = pdfium.PdfDocument(pdf_file)
+        try:
+            text = "\n".join(page.get_textpage().get_text_bounded() for page in pdf)
+        finally:
+            pdf.close()
         return text.strip()
     except Exception as e:
         print(f"Erro ao extrair texto do PDF: {e}")
@@ -27,10 +94,7 @@ def extract_text_from_docx(docx_file):
     """Extrai texto de um arquivo Word (.docx)"""
     try:
         doc = Document(docx_file)
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text.strip()
+        return "\n".join(paragraph.text for paragraph in doc.paragraphs).strip()
     except Exception as e:
         print(f"Erro ao extrair texto do Word: {e}")
         return ""
@@ -65,49 +129,230 @@ def extract_text_from_file(file, filename):
     else:
         return ""
 
+def load_idf_transformer(path):
+    """Carrega um TfidfTransformer pré-ajustado (sobre HASHING_PARAMS), se existir e for válido"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            transformer = pickle.load(f)
+    except Exception as e:
+        print(f"Erro ao carregar IDF pré-calculado: {e}")
+        return None
+    
+    # O IDF precisa ter uma posição para cada feature do hashing_vectorizer
+    idf = getattr(transformer, 'idf_', None)
+    if idf is None or not hasattr(transformer, 'transform') or idf.shape[0] != HASHING_PARAMS['n_features']:
+        print(f"✗ IDF pré-calculado em {path} inválido ou incompatível; ajustando por requisição")
+        return None
+    
+    print(f"✓ IDF pré-calculado carregado de {path}")
+    return transformer
+
+def load_sklearn():
+    """Prepara o vetorizador e o IDF pré-calculado na primeira utilização"""
+    global hashing_vectorizer, idf_transformer
+    
+    if hashing_vectorizer is not None:
+        return
+    
+    with sklearn_lock:
+        if hashing_vectorizer is not None:
+            return
+        
+        from sklearn.feature_extraction.text import HashingVectorizer
+        
+        idf_transformer = load_idf_transformer(IDF_MODEL_PATH)
+        # Atribuído por último: serve de sentinela para as demais threads
+        hashing_vectorizer = HashingVectorizer(**HASHING_PARAMS)
+
+def _extract_worker(item):
+    """Extrai texto de (conteúdo, nome) em um processo do pool"""
+    raw, filename = item
+    try:
+        # BytesIO sobre bytes imutáveis compartilha o buffer (sem cópia extra)
+        return extract_text_from_file(io.BytesIO(raw), filename)
+    except Exception as e:
+        print(f"✗ Erro ao processar {filename}: {e}")
+        return ""
+
+def _read_upload(file):
+    """Lê um arquivo enviado e calcula o hash do conteúdo (None se exceder MAX_FILE_SIZE)"""
+    raw = file.stream.read(MAX_FILE_SIZE + 1)
+    if len(raw) > MAX_FILE_SIZE:
+        return raw, None
+    return raw, hashlib.blake2b(raw, digest_size=16).digest()
+
+def cache_text(key, text):
+    """Guarda um texto extraído, descartando os mais antigos além de TEXT_CACHE_MAX_CHARS"""
+    global text_cache_chars
+    
+    # Textos maiores que o orçamento inteiro não entram no cache
+    if key in text_cache or len(text) > TEXT_CACHE_MAX_CHARS:
+        return
+    text_cache[key] = text
+    text_cache_chars += len(text)
+    while text_cache_chars > TEXT_CACHE_MAX_CHARS:
+        _, evicted = text_cache.popitem(last=False)
+        text_cache_chars -= len(evicted)
+
+def vectorize_texts(texts):
+    """Vetoriza textos reaproveitando linhas já calculadas em requisições anteriores"""
+    global vector_cache_nnz
+    
+    keys = [hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest() for text in texts]
+    rows = {}
+    misses = {}
+    
+    with vector_cache_lock:
+        for key, text in zip(keys, texts):
+            if key in vector_cache:
+                vector_cache.move_to_end(key)
+                rows[key] = vector_cache[key]
+            elif key not in misses:
+                misses[key] = text
+    
+    # Vetorizar apenas os textos ainda não vistos
+    if misses:
+        new_rows = hashing_vectorizer.transform(list(misses.values()))
+        with vector_cache_lock:
+            for index, key in enumerate(misses):
+                row = rows[key] = new_rows[index]
+                # Linhas maiores que o orçamento inteiro não entram no cache
+                if key in vector_cache or row.nnz > VECTOR_CACHE_MAX_NNZ:
+                    continue
+                vector_cache[key] = row
+                vector_cache_nnz += row.nnz
+            while vector_cache_nnz > VECTOR_CACHE_MAX_NNZ:
+                _, evicted = vector_cache.popitem(last=False)
+                vector_cache_nnz -= evicted.nnz
+    
+    return sparse.vstack([rows[key] for key in keys], format='csr')
+
+def find_similar_pairs(X, threshold):
+    """Encontra pares (i < j) com similaridade >= threshold, bloco a bloco"""
+    n = X.shape[0]
+    XT = X.T.tocsr()
+    rows, cols, vals = [], [], []
+    
+    # Cada bloco de linhas gera uma faixa densa pequena (cabe em cache),
+    # filtrada antes de calcular o próximo bloco
+    for start in range(0, n, SIMILARITY_BLOCK_SIZE):
+        block = (X[start:start + SIMILARITY_BLOCK_SIZE] @ XT).toarray()
+        # Manter apenas o triângulo superior (coluna > linha global)
+        mask = np.triu(block >= threshold, k=start + 1)
+        block_rows, block_cols = np.nonzero(mask)
+        rows.append(block_rows + start)
+        cols.append(block_cols)
+        vals.append(block[block_rows, block_cols])
+    
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(vals)
+
+def find_similar_pairs_gpu(X, threshold):
+    """Encontra pares (i < j) com similaridade >= threshold usando cuSPARSE SpGEMM"""
+    Xg = cupy_sparse.csr_matrix(X)
+    similarity = cusparse.spgemm(Xg, Xg.T.tocsr())
+    upper = cupy_sparse.triu(similarity, k=1).tocoo()
+    # Trazer para a CPU apenas as entradas acima do limiar
+    mask = upper.data >= threshold
+    return upper.row[mask].get(), upper.col[mask].get(), upper.data[mask].get()
+
+def _load_cupy():
+    """Importa o CuPy na primeira utilização da GPU; retorna False se indisponível"""
+    global USE_GPU, cupy_sparse, cusparse
+    
+    if cusparse is not None:
+        return True
+    try:
+        import cupyx.scipy.sparse as cupy_sparse_module
+        from cupyx import cusparse as cusparse_module
+    except ImportError as e:
+        print(f"CuPy indisponível, usando CPU: {e}")
+        USE_GPU = False
+        return False
+    
+    cupy_sparse = cupy_sparse_module
+    cusparse = cusparse_module
+    return True
+
+def _cosine_pairs(X, threshold):
+    """Escolhe a implementação do produto esparso conforme o dispositivo"""
+    if USE_GPU and X.nnz >= GPU_MIN_NNZ and _load_cupy():
+        try:
+            return find_similar_pairs_gpu(X, threshold)
+        except Exception as e:
+            print(f"Erro na GPU, usando CPU: {e}")
+    # Na CPU, manter scipy CSR: wrappers esparsos de frameworks (torch/tf)
+    # são ordens de grandeza mais lentos para este produto
+    return find_similar_pairs(sparse.csr_matrix(X), threshold)
+
 def calculate_similarity(texts):
-    """Calcula similaridade entre textos usando TF-IDF e Cosine Similarity"""
+    """Calcula pares similares usando TF-IDF e Cosine Similarity"""
     if len(texts) < 2:
-        return []
-    
-    # Criar vetores TF-IDF
-    vectorizer = TfidfVectorizer(
-        min_df=1,
-        stop_words=None,  # Pode adicionar stop words em português se quiser
-        ngram_range=(1, 2)  # Usar unigramas e bigramas
-    )
+        return None
     
     try:
-        tfidf_matrix = vectorizer.fit_transform(texts)
-        # Calcular similaridade de cosseno
-        similarity_matrix = cosine_similarity(tfidf_matrix)
-        return similarity_matrix
+        load_sklearn()
+        from sklearn.feature_extraction.text import TfidfTransformer
+        from sklearn.preprocessing import normalize
+        
+        # Criar vetores TF-IDF (hashing evita construir um vocabulário)
+        counts = vectorize_texts(texts)
+        if idf_transformer is not None:
+            # Reaproveitar o IDF pré-calculado, sem reajustar a cada requisição
+            tfidf_matrix = idf_transformer.transform(counts)
+        else:
+            tfidf_matrix = TfidfTransformer(sublinear_tf=True).fit_transform(counts)
+        tfidf_matrix = tfidf_matrix.astype(np.float32, copy=False)
+        # Com linhas de norma L2 unitária, X @ X.T já é a similaridade de cosseno
+        X = normalize(tfidf_matrix, norm='l2', copy=False)
+        return _cosine_pairs(X, SIMILARITY_THRESHOLD)
     except Exception as e:
         print(f"Erro ao calcular similaridade: {e}")
-        return []
+        return None
+
+def create_process_pool():
+    """Cria o pool de extração iniciando os processos via forkserver"""
+    # Os processos só nascem no primeiro submit, dentro de uma requisição, quando
+    # já há threads ativas; um fork nesse momento pode travar os filhos, então
+    # usar forkserver (ou spawn onde não existir)
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    return ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=context)
+
+@app.before_serving
+async def start_process_pool():
+    """Cria o pool de extração uma única vez, reaproveitado entre requisições"""
+    app.config['POOL'] = create_process_pool()
+
+@app.after_serving
+async def stop_process_pool():
+    """Encerra o pool de extração junto com o servidor"""
+    app.config['POOL'].shutdown()
 
 @app.route('/')
-def home():
+async def home():
     return jsonify({
         "message": "CaughtTweaking API está rodando!",
         "status": "online"
     })
 
 @app.route('/analyze', methods=['POST'])
-def analyze():
+async def analyze():
     """Endpoint principal para análise de arquivos"""
     
     # Verificar se arquivos foram enviados
-    if 'files' not in request.files:
+    request_files = await request.files
+    if 'files' not in request_files:
         return jsonify({"error": "Nenhum arquivo enviado"}), 400
     
-    files = request.files.getlist('files')
+    files = request_files.getlist('files')
     
     if len(files) < 2:
         return jsonify({"error": "Envie pelo menos 2 arquivos"}), 400
     
-    if len(files) > 100:
-        return jsonify({"error": "Máximo de 100 arquivos permitidos"}), 400
+    if len(files) > MAX_FILES:
+        return jsonify({"error": f"Máximo de {MAX_FILES} arquivos permitidos"}), 400
     
     # Extrair texto de todos os arquivos
     documents = []
@@ -115,62 +360,127 @@ def analyze():
     
     print(f"Processando {len(files)} arquivos...")
     
+    loop = asyncio.get_running_loop()
+    executor = app.config['POOL']
+    
+    # Cada arquivo segue para extração assim que é lido; no máximo
+    # os.cpu_count() arquivos lidos e ainda não extraídos ficam em memória
+    slots = asyncio.Semaphore(os.cpu_count() or 1)
+    
+    async def extract(raw, filename):
+        try:
+            # PDFium não é thread-safe e python-docx é Python puro, então PDF/Word
+            # vão para processos; TXT é só decodificação e roda em threads,
+            # sem custo de pickle dos bytes
+            return await loop.run_in_executor(
+                None if filename.lower().endswith('.txt') else executor,
+                _extract_worker,
+                (raw, filename)
+            )
+        finally:
+            slots.release()
+    
+    # Ler cada arquivo uma única vez do stream (FileStorage não é picklable,
+    # então os bytes crus são enviados ao pool)
+    uploads = []
+    texts_by_key = {}
+    pending = {}
     for file in files:
         file_extension = file.filename.lower().split('.')[-1]
         
-        if file_extension in ['pdf', 'docx', 'doc', 'txt']:
-            try:
-                # Ler arquivo em memória
-                file_content = io.BytesIO(file.read())
-                text = extract_text_from_file(file_content, file.filename)
-                
-                if text:
-                    documents.append(text)
-                    file_names.append(file.filename)
-                    print(f"✓ {file.filename} processado ({file_extension.upper()})")
-                else:
-                    print(f"✗ {file.filename} - sem texto extraído")
-            except Exception as e:
-                print(f"✗ Erro ao processar {file.filename}: {e}")
+        # Ignorar extensões não suportadas antes de ler qualquer byte
+        if file_extension not in ['pdf', 'docx', 'doc', 'txt']:
+            print(f"✗ {file.filename} - formato não suportado")
+            continue
+        
+        await slots.acquire()
+        # Leitura e hash fora do event loop
+        raw, digest = await loop.run_in_executor(None, _read_upload, file)
+        if digest is None:
+            slots.release()
+            for task in pending.values():
+                task.cancel()
+            return jsonify({"error": f"Arquivo {file.filename} excede o tamanho máximo permitido"}), 413
+        
+        key = (digest, file_extension)
+        uploads.append((key, file.filename))
+        
+        # Arquivos repetidos (mesmo conteúdo, outro nome) ou já vistos em
+        # requisições anteriores reaproveitam o texto extraído, sem guardar os bytes
+        if key in texts_by_key or key in pending:
+            slots.release()
+        elif key in text_cache:
+            text_cache.move_to_end(key)
+            texts_by_key[key] = text_cache[key]
+            slots.release()
+        else:
+            pending[key] = asyncio.create_task(extract(raw, file.filename))
+        del raw
+    
+    # Aguardar as extrações em andamento, preservando a ordem dos arquivos
+    if pending:
+        try:
+            extracted = await asyncio.gather(*pending.values())
+        except BrokenProcessPool as e:
+            # Um processo morreu (ex.: falha nativa no parser); recriar o pool
+            print(f"Erro no pool de extração: {e}")
+            for task in pending.values():
+                task.cancel()
+            # Só substituir se outra requisição ainda não o fez
+            if app.config['POOL'] is executor:
+                executor.shutdown(wait=False)
+                app.config['POOL'] = create_process_pool()
+            return jsonify({"error": "Erro ao processar os arquivos"}), 500
+        for key, text in zip(pending, extracted):
+            texts_by_key[key] = text
+            cache_text(key, text)
+        # As tarefas concluídas não precisam mais dos bytes crus
+        pending.clear()
+    
+    for key, filename in uploads:
+        text = texts_by_key[key]
+        if text:
+            documents.append(text)
+            file_names.append(filename)
+            print(f"✓ {filename} processado ({filename.lower().split('.')[-1].upper()})")
+        else:
+            print(f"✗ {filename} - sem texto extraído")
     
     if len(documents) < 2:
         return jsonify({"error": "Não foi possível extrair texto de arquivos suficientes"}), 400
     
     # Calcular similaridade
     print("Calculando similaridades...")
-    similarity_matrix = calculate_similarity(documents)
+    # (só incluir pares com similaridade >= 40%)
+    pairs = await loop.run_in_executor(None, calculate_similarity, documents)
     
-    if len(similarity_matrix) == 0:
+    if pairs is None:
         return jsonify({"error": "Erro ao calcular similaridades"}), 500
     
-    # Preparar resultados
-    results = []
-    for i in range(len(file_names)):
-        for j in range(i + 1, len(file_names)):
-            similarity_score = similarity_matrix[i][j] * 100  # Converter para porcentagem
-            
-            # Só incluir se similaridade >= 40%
-            if similarity_score >= 40:
-                results.append({
-                    "file1": file_names[i],
-                    "file2": file_names[j],
-                    "similarity": round(similarity_score, 2)
-                })
-    
-    # Ordenar por similaridade (maior primeiro)
-    results.sort(key=lambda x: x['similarity'], reverse=True)
+    rows, cols, vals = pairs
+    
+    # Converter para porcentagem e ordenar por similaridade (maior primeiro)
+    pct = np.round(vals.astype(np.float64) * 100, 2)
+    order = np.argsort(-pct, kind='stable')
+    rows, cols, pct = rows[order], cols[order], pct[order]
+    
+    results = [
+        {"file1": file_names[i], "file2": file_names[j], "similarity": score}
+        for i, j, score in zip(rows.tolist(), cols.tolist(), pct.tolist())
+    ]
     
     print(f"Análise concluída! {len(results)} pares com similaridade >= 40%")
     
-    return jsonify({
+    # orjson serializa direto para bytes, bem mais rápido que o json padrão
+    return app.response_class(orjson.dumps({
         "success": True,
         "total_files": len(file_names),
         "comparisons": len(results),
         "results": results
-    })
+    }), mimetype='application/json')
 
 @app.route('/health', methods=['GET'])
-def health():
+async def health():
     """Endpoint para verificar saúde da API"""
     return jsonify({
         "status": "healthy",
@@ -0,0 +1,42 @@
+"""Gera o idf.pkl usado pelo app a partir de um corpus de referência
+
+Uso: python build_idf.py <pasta_com_arquivos> [saida.pkl]
+"""
+import os
+import pickle
+import sys
+
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+
+from app import HASHING_PARAMS, IDF_MODEL_PATH, extract_text_from_file
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    
+    corpus_dir = sys.argv[1]
+    output_path = sys.argv[2] if len(sys.argv) > 2 else IDF_MODEL_PATH
+    
+    texts = []
+    for filename in sorted(os.listdir(corpus_dir)):
+        with open(os.path.join(corpus_dir, filename), 'rb') as f:
+            text = extract_text_from_file(f, filename)
+        if text:
+            texts.append(text)
+            print(f"✓ {filename}")
+    
+    if not texts:
+        print("Nenhum texto extraído do corpus")
+        sys.exit(1)
+    
+    # Mesmos parâmetros do app, para que o idf_ tenha uma posição por feature
+    counts = HashingVectorizer(**HASHING_PARAMS).transform(texts)
+    transformer = TfidfTransformer(sublinear_tf=True).fit(counts)
+    
+    with open(output_path, 'wb') as f:
+        pickle.dump(transformer, f)
+    print(f"IDF de {len(texts)} documentos salvo em {output_path}")
+
+if __name__ == '__main__':
+    main()